@@ -1,12 +1,17 @@
+import functools
 import json
 import logging
 import os
+import re
 import asyncio
-import uuid
+import secrets
+import sys
+import time
+from collections import deque
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import List, Dict, Optional, Annotated
+from typing import List, Dict, Deque, Optional, Set, Tuple, Annotated
 
+import numpy as np
 from dotenv import load_dotenv
 from pydantic import Field
 from livekit.agents import (
@@ -24,6 +29,19 @@ from livekit.agents import (
 from livekit.plugins import murf, silero, google, deepgram, noise_cancellation
 from livekit.plugins.turn_detector.multilingual import MultilingualModel
 
+# Use uvloop (winloop on Windows) for the worker's event loop when installed;
+# the stock asyncio loop is noticeably slower for the STT/TTS socket traffic.
+try:
+    if sys.platform == "win32":
+        import winloop as _fast_loop
+    else:
+        import uvloop as _fast_loop
+except ImportError:
+    _fast_loop = None
+
+if _fast_loop is not None:
+    asyncio.set_event_loop_policy(_fast_loop.EventLoopPolicy())
+
 # -------------------------
 # Logging
 # -------------------------
@@ -35,10 +53,41 @@ logger.addHandler(handler)
 
 load_dotenv(".env.local")
 
+# slots=True is only accepted by dataclass() on Python 3.10+
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
 # -------------------------
 # Simple Product Catalog (Lalit's Shop)
 # -------------------------
-CATALOG: List[Dict] = [
+
+@dataclass(frozen=True, **_DATACLASS_SLOTS)
+class Product:
+    id: str
+    name: str
+    description: str
+    price: int
+    currency: str
+    category: str
+    color: str
+    sizes: Tuple[str, ...]
+    # lowercased copies of the searchable text fields, computed once so the
+    # filters and the ref resolver never call .lower() on catalog data
+    name_lc: str = field(init=False, repr=False, compare=False)
+    desc_lc: str = field(init=False, repr=False, compare=False)
+    cat_lc: str = field(init=False, repr=False, compare=False)
+    color_lc: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # frozen: derived fields have to go through object.__setattr__
+        set_ = object.__setattr__
+        set_(self, "sizes", tuple(self.sizes))
+        set_(self, "name_lc", self.name.lower())
+        set_(self, "desc_lc", self.description.lower())
+        set_(self, "cat_lc", self.category.lower())
+        set_(self, "color_lc", (self.color or "").lower())
+
+
+_RAW_CATALOG: List[Dict] = [
     {
         "id": "mug-001",
         "name": "Stoneware Chai Mug",
@@ -276,46 +325,220 @@ CATALOG: List[Dict] = [
     },
 ]
 
+CATALOG: List[Product] = [Product(**d) for d in _RAW_CATALOG]
+del _RAW_CATALOG
+
+# id -> product, for O(1) lookups from cart lines and orders
+CATALOG_BY_ID: Dict[str, Product] = {p.id: p for p in CATALOG}
+
+# Column (struct-of-arrays) view of CATALOG for vectorized filtering in
+# list_products; element i of every column describes CATALOG[i].
+_PRICES = np.array([p.price for p in CATALOG], dtype=np.int64)
+_CATEGORIES = np.array([p.cat_lc for p in CATALOG])
+_COLORS = np.array([p.color_lc for p in CATALOG])
+_CATEGORY_NAMES: List[str] = sorted(set(_CATEGORIES.tolist()))
+_MOBILE_PRODUCTS: List[Product] = [p for p in CATALOG if p.cat_lc == "mobile"]
+
+# Word index over product names (token -> product ids) so
+# find_product_by_ref does no per-call substring scans.
+NAME_TOKENS: Dict[str, Set[str]] = {}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+for _p in CATALOG:
+    for _t in _WORD_RE.findall(_p.name_lc):
+        if len(_t) > 2:
+            NAME_TOKENS.setdefault(_t, set()).add(_p.id)
+del _p, _t
+
+# spoken category synonyms -> catalog category
+_CATEGORY_ALIASES: Dict[str, str] = {
+    "phone": "mobile",
+    "phones": "mobile",
+    "mobile phone": "mobile",
+    "mobiles": "mobile",
+    "t-shirts": "tshirt",
+    "tees": "tshirt",
+    "tee": "tshirt",
+}
+
+# spoken list positions ('the second one') for find_product_by_ref
+_ORDINAL_RE = re.compile(r"\b(first|second|third|fourth)\b")
+_ORDINAL_POS: Dict[str, int] = {"first": 0, "second": 1, "third": 2, "fourth": 3}
+
 # -------------------------
 # Orders persistence
 # -------------------------
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-ORDERS_FILE = os.path.join(BASE_DIR, "orders.json")
+# append-only log: one JSON order per line
+ORDERS_FILE = os.path.join(BASE_DIR, "orders.jsonl")
+LEGACY_ORDERS_FILE = os.path.join(BASE_DIR, "orders.json")
+
+# orjson (C) for the orders log when available; compact stdlib json otherwise.
+# Both produce one-line UTF-8 bytes per record.
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    _loads = json.loads
+
+
+def _migrate_legacy_orders():
+    """One-time conversion of the old single-array orders.json to JSONL."""
+    if os.path.exists(ORDERS_FILE) or not os.path.exists(LEGACY_ORDERS_FILE):
+        return
+    try:
+        with open(LEGACY_ORDERS_FILE, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        with open(ORDERS_FILE, "wb") as f:
+            for order in legacy:
+                f.write(_dumps(order) + b"\n")
+    except Exception:
+        logger.exception("could not migrate %s", LEGACY_ORDERS_FILE)
 
-if not os.path.exists(ORDERS_FILE):
-    with open(ORDERS_FILE, "w", encoding="utf-8") as f:
-        json.dump([], f)
 
+_migrate_legacy_orders()
 
-@dataclass
+
+_last_iso = (0, "")  # (epoch second, formatted string); swapped as one tuple
+
+
+def _utc_now_iso() -> str:
+    """UTC '...Z' timestamp, formatted at most once per wall-clock second."""
+    global _last_iso
+    sec = time.time_ns() // 1_000_000_000
+    cached_sec, text = _last_iso
+    if sec != cached_sec:
+        text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(sec))
+        _last_iso = (sec, text)
+    return text
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class Userdata:
     customer_name: Optional[str] = None
-    session_id: str = field(default_factory=lambda: str(uuid.uuid4())[:8])
-    started_at: str = field(default_factory=lambda: datetime.utcnow().isoformat() + "Z")
-    cart: List[Dict] = field(default_factory=list)   # {product_id, quantity, attrs}
+    session_id: str = field(default_factory=lambda: secrets.token_hex(4))
+    started_at: str = field(default_factory=_utc_now_iso)
+    cart: List[Dict] = field(default_factory=list)   # {product_id, name, unit_price, quantity, attrs}
+    cart_total: int = 0  # running sum of cart line totals
     orders: List[Dict] = field(default_factory=list)
-    history: List[Dict] = field(default_factory=list)
+    history: Deque[Dict] = field(default_factory=lambda: deque(maxlen=128))  # oldest entries drop off
 
 
 # -------------------------
 # Merchant-layer helpers
 # -------------------------
 def _load_all_orders() -> List[Dict]:
+    orders: List[Dict] = []
     try:
-        with open(ORDERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+        with open(ORDERS_FILE, "rb") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        orders.append(_loads(line))
+                    except ValueError:
+                        continue  # skip a torn trailing write
+    except FileNotFoundError:
+        pass
+    return orders
+
+
+def _read_last_line(path: str, chunk_size: int = 4096) -> Optional[bytes]:
+    """Return the last non-empty line of a file, reading backwards from the end."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            buf = b""
+            while pos > 0:
+                step = min(chunk_size, pos)
+                pos -= step
+                f.seek(pos)
+                buf = f.read(step) + buf
+                tail = buf.rstrip()
+                nl = tail.rfind(b"\n")
+                if nl != -1:
+                    return tail[nl + 1 :]
+            return buf.strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _load_last_order() -> Optional[Dict]:
+    last = _read_last_line(ORDERS_FILE)
+    if not last:
+        return None
+    try:
+        return _loads(last)
+    except ValueError:
+        # torn last line; fall back to the last complete record
+        orders = _load_all_orders()
+        return orders[-1] if orders else None
 
 
-def _save_order(order: Dict):
-    orders = _load_all_orders()
-    orders.append(order)
-    with open(ORDERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(orders, f, indent=2)
+def _log_stamp() -> Optional[Tuple[int, int]]:
+    """(size, mtime_ns) of the orders log, or None if it doesn't exist yet."""
+    try:
+        st = os.stat(ORDERS_FILE)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _append_order_line(order: Dict) -> Optional[Tuple[int, int]]:
+    """Append one record; returns the log's stamp if ours is still the last line."""
+    record = _dumps(order) + b"\n"
+    with open(ORDERS_FILE, "a+b") as f:
+        # a crash can leave a partial last line without its newline; start a
+        # fresh line so this record isn't glued onto it and lost with it
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                record = b"\n" + record
+        f.write(record)
+        f.flush()
+        os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+        return (st.st_size, st.st_mtime_ns) if st.st_size == f.tell() else None
+
+
+# Last order in the log and the _log_stamp() it corresponds to. Every room
+# runs in its own job process and appends to the same log, so this is only
+# a cache: get_most_recent_order re-tails the file whenever the stamp moved.
+_LAST_ORDER: Optional[Dict] = None
+_LAST_ORDER_STAMP: Optional[Tuple[int, int]] = None
+
+
+# Serializes writers so concurrent place_order calls (several rooms in one
+# worker) land in the log and in _LAST_ORDER in the same order. Created on first
+# use so it binds to the running loop (Python 3.9 binds at construction).
+_ORDERS_LOCK: Optional[asyncio.Lock] = None
+
+
+async def _save_order(order: Dict):
+    global _LAST_ORDER, _LAST_ORDER_STAMP, _ORDERS_LOCK
+    if _ORDERS_LOCK is None:
+        _ORDERS_LOCK = asyncio.Lock()
+    async with _ORDERS_LOCK:
+        # the append runs in a worker thread so the event loop never waits on disk
+        stamp = await asyncio.to_thread(_append_order_line, order)
+        # only a persisted order becomes the "last order"; a None stamp (another
+        # process appended right behind us) makes the next read re-tail the log
+        _LAST_ORDER, _LAST_ORDER_STAMP = order, stamp
+
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
 
 
-def list_products(filters: Optional[Dict] = None) -> List[Dict]:
+def list_products(filters: Optional[Dict] = None) -> List[Product]:
     """
     Naive filtering by category, max_price, color, size, and query words.
 
@@ -323,134 +546,163 @@ def list_products(filters: Optional[Dict] = None) -> List[Dict]:
     - Supports min_price / max_price if present.
     """
     filters = filters or {}
-    results: List[Dict] = []
+    args = (
+        filters.get("q"),
+        filters.get("category"),
+        filters.get("max_price") or filters.get("to") or filters.get("max"),
+        filters.get("min_price") or filters.get("from") or filters.get("min"),
+        filters.get("color"),
+        filters.get("size"),
+    )
+    try:
+        hash(args)
+    except TypeError:
+        # unhashable filter values (e.g. a list) can't key the cache
+        ids = _filter_product_ids.__wrapped__(*args)
+    else:
+        ids = _filter_product_ids(*args)
+    return [CATALOG_BY_ID[pid] for pid in ids]
+
 
-    query = filters.get("q")
-    category = filters.get("category")
-    max_price = filters.get("max_price") or filters.get("to") or filters.get("max")
-    min_price = filters.get("min_price") or filters.get("from") or filters.get("min")
-    color = filters.get("color")
-    size = filters.get("size")
+# CATALOG never changes at runtime, so cached results never go stale.
+@functools.lru_cache(maxsize=256)
+def _filter_product_ids(query, category, max_price, min_price, color, size) -> Tuple[str, ...]:
+    results: List[str] = []
 
     # normalize category synonyms
     if category:
         cat = category.lower()
-        if cat in ("phone", "phones", "mobile", "mobile phone", "mobiles"):
-            category = "mobile"
-        elif cat in ("tshirt", "t-shirts", "tees", "tee"):
-            category = "tshirt"
-        else:
-            category = cat
-
-    for p in CATALOG:
-        ok = True
-
+        category = _CATEGORY_ALIASES.get(cat, cat)
+
+    max_int = _as_int(max_price) if max_price else None
+    min_int = _as_int(min_price) if min_price else None
+    color_lc = color.lower() if color else None
+    query_lc = query.lower() if query else None
+    # if query mentions 'phone' or 'mobile', prefer mobile
+    query_wants_mobile = bool(query_lc) and ("phone" in query_lc or "mobile" in query_lc)
+
+    # cheap column filters run vectorized over the whole catalog; only the
+    # survivors go through the per-product size/query checks below
+    mask = np.ones(len(CATALOG), dtype=bool)
+    if category:
         # category matching: allow substring matches
-        if category:
-            pcat = p.get("category", "").lower()
-            if pcat != category and category not in pcat and pcat not in category:
-                ok = False
-
-        if max_price:
-            try:
-                if p.get("price", 0) > int(max_price):
-                    ok = False
-            except Exception:
-                pass
-
-        if min_price:
-            try:
-                if p.get("price", 0) < int(min_price):
-                    ok = False
-            except Exception:
-                pass
-
-        if color and p.get("color") and p.get("color").lower() != color.lower():
-            ok = False
+        names = [c for c in _CATEGORY_NAMES if c == category or category in c or c in category]
+        mask &= np.isin(_CATEGORIES, names)
+    if max_int is not None:
+        mask &= _PRICES <= max_int  # noqa: SIM300 (array column, not a constant)
+    if min_int is not None:
+        mask &= _PRICES >= min_int  # noqa: SIM300
+    if color_lc:
+        # products without a color are not excluded by a color filter
+        mask &= (_COLORS == color_lc) | (_COLORS == "")  # noqa: SIM300
+
+    catalog = CATALOG
+    for i in np.flatnonzero(mask).tolist():
+        p = catalog[i]
+        ok = True
 
         if size:
-            if not p.get("sizes") or size not in p.get("sizes"):
+            if size not in p.sizes:
                 ok = False
 
-        if query:
-            q = query.lower()
-            # if query mentions 'phone' or 'mobile', prefer mobile
-            if "phone" in q or "mobile" in q:
-                if p.get("category") != "mobile":
+        if query_lc:
+            if query_wants_mobile:
+                if p.cat_lc != "mobile":
                     ok = False
             else:
-                if q not in p.get("name", "").lower() and q not in p.get("description", "").lower():
+                if query_lc not in p.name_lc and query_lc not in p.desc_lc:
                     ok = False
 
         if ok:
-            results.append(p)
+            results.append(p.id)
 
-    return results
+    return tuple(results)
 
 
-def find_product_by_ref(ref_text: str, candidates: Optional[List[Dict]] = None) -> Optional[Dict]:
+def find_product_by_ref(ref_text: str, candidates: Optional[List[Product]] = None) -> Optional[Product]:
     """
     Resolve references like 'second hoodie', 'black hoodie', 'phone-003' to a product.
 
     Heuristics:
-    - Ordinals: first/second/third/fourth in a candidate list.
     - Exact id match.
+    - Ordinals: first/second/third/fourth in a candidate list.
     - Color + category.
-    - Name substring.
+    - Name words (all, then any).
     - Numeric index ('2' -> second).
     """
     ref = (ref_text or "").lower().strip()
     cand = candidates if candidates is not None else CATALOG
 
+    # fast path: the resolver heard an exact id like 'phone-003'
+    by_id = CATALOG_BY_ID.get(ref)
+    if by_id is not None and (candidates is None or by_id in cand):
+        return by_id
+
+    words = ref.split()
+    if not words:
+        return None
+
     # prefer mobiles if user mentions phone/mobile
-    wants_mobile = any(w in ref for w in ("phone", "phones", "mobile", "mobiles"))
+    wants_mobile = "phone" in ref or "mobile" in ref
     filtered = cand
     if wants_mobile:
-        filtered = [p for p in cand if p.get("category") == "mobile"] or cand
+        if candidates is None:
+            filtered = _MOBILE_PRODUCTS or cand
+        else:
+            filtered = [p for p in cand if p.cat_lc == "mobile"] or cand
 
-    ordinals = {"first": 0, "second": 1, "third": 2, "fourth": 3}
-    for word, idx in ordinals.items():
-        if word in ref and idx < len(filtered):
-            return filtered[idx]
+    # a bare number ('2') can only be a list position
+    if "".join(words).isdigit():
+        return _pick_by_number(words, filtered)
 
-    # direct id match
-    for p in cand:
-        if p["id"].lower() == ref:
-            return p
+    m = _ORDINAL_RE.search(ref)
+    if m:
+        idx = _ORDINAL_POS[m.group(1)]
+        if idx < len(filtered):
+            return filtered[idx]
 
     # color + category combination
     for p in cand:
-        if p.get("color") and p["color"].lower() in ref and p.get("category") and p["category"] in ref:
+        if p.color_lc and p.color_lc in ref and p.cat_lc and p.cat_lc in ref:
             return p
 
-    # strong name substring
-    tokens = [t for t in ref.split() if len(t) > 2]
-    for p in filtered:
-        name = p["name"].lower()
-        if tokens and all(t in name for t in tokens):
-            return p
-
-    # weaker match
-    for p in cand:
-        name = p["name"].lower()
-        if any(t in name for t in tokens):
-            return p
-
-    # numeric index
-    for token in ref.split():
-        if token.isdigit():
-            idx = int(token) - 1
-            if 0 <= idx < len(filtered):
-                return filtered[idx]
-
+    # name words: posting lists from NAME_TOKENS instead of scanning names
+    tokens = [t for t in _WORD_RE.findall(ref) if len(t) > 2]
+    postings = [NAME_TOKENS.get(t, set()) for t in tokens]
+
+    # strong match: every word appears in the name
+    if postings:
+        strong = set.intersection(*postings)
+        if strong:
+            for p in filtered:
+                if p.id in strong:
+                    return p
+
+    # weaker match: any word appears in the name
+    weak = set().union(*postings)
+    if weak:
+        for p in cand:
+            if p.id in weak:
+                return p
+
+    return _pick_by_number(words, filtered)
+
+
+def _pick_by_number(words: List[str], products: List[Product]) -> Optional[Product]:
+    """Numeric index: the first number word that is a valid 1-based position."""
+    for word in words:
+        if word.isdigit():
+            idx = int(word) - 1
+            if 0 <= idx < len(products):
+                return products[idx]
     return None
 
 
-def create_order_object(line_items: List[Dict], currency: str = "INR") -> Dict:
+async def create_order_object(line_items: List[Dict], currency: str = "INR") -> Dict:
     """
     line_items: [{product_id, quantity, attrs}]
     Returns an order dict: {id, items, total, currency, created_at}
-    and persists it to orders.json.
+    and appends it to orders.jsonl.
     """
     items: List[Dict] = []
     total = 0
@@ -458,16 +710,16 @@ def create_order_object(line_items: List[Dict], currency: str = "INR") -> Dict:
     for li in line_items:
         pid = li.get("product_id")
         qty = int(li.get("quantity", 1))
-        prod = next((p for p in CATALOG if p["id"] == pid), None)
+        prod = CATALOG_BY_ID.get(pid)
         if not prod:
             raise ValueError(f"Product {pid} not found")
-        line_total = prod["price"] * qty
+        line_total = prod.price * qty
         total += line_total
         items.append(
             {
                 "product_id": pid,
-                "name": prod["name"],
-                "unit_price": prod["price"],
+                "name": prod.name,
+                "unit_price": prod.price,
                 "quantity": qty,
                 "line_total": line_total,
                 "attrs": li.get("attrs", {}),
@@ -475,43 +727,36 @@ def create_order_object(line_items: List[Dict], currency: str = "INR") -> Dict:
         )
 
     order = {
-        "id": f"order-{str(uuid.uuid4())[:8]}",
+        "id": f"order-{secrets.token_hex(4)}",
         "items": items,
         "total": total,
         "currency": currency,
-        "created_at": datetime.utcnow().isoformat() + "Z",
+        "created_at": _utc_now_iso(),
     }
-    _save_order(order)
+    await _save_order(order)
     return order
 
 
-def get_most_recent_order() -> Optional[Dict]:
-    all_orders = _load_all_orders()
-    return all_orders[-1] if all_orders else None
+async def get_most_recent_order() -> Optional[Dict]:
+    global _LAST_ORDER, _LAST_ORDER_STAMP
+    stamp = await asyncio.to_thread(_log_stamp)
+    if stamp != _LAST_ORDER_STAMP:
+        _LAST_ORDER = await asyncio.to_thread(_load_last_order)
+        _LAST_ORDER_STAMP = stamp
+    return _LAST_ORDER
 
-# -------------------------
-# TOOLS
-# -------------------------
 
-@function_tool
-async def show_catalog(
-    ctx: RunContext[Userdata],
-    q: Annotated[Optional[str], Field(description="Search query (optional)", default=None)] = None,
-    category: Annotated[Optional[str], Field(description="Category (optional)", default=None)] = None,
-    max_price: Annotated[Optional[int], Field(description="Maximum price (optional)", default=None)] = None,
-    color: Annotated[Optional[str], Field(description="Color (optional)", default=None)] = None,
+@functools.lru_cache(maxsize=256)
+def _catalog_reply(
+    q: Optional[str], category: Optional[str], max_price: Optional[int], color: Optional[str]
 ) -> str:
-    """
-    Return a spoken summary of matching products (name, price, id).
-    - Recognizes category synonyms like 'phones', 'tees'.
-    - Returns up to 8 items.
-    """
+    """show_catalog's reply text, memoized per filter combination."""
     # category auto-detect from query
     if not category and q:
         q_lower = q.lower()
-        if any(w in q_lower for w in ("phone", "phones", "mobile", "mobiles")):
+        if "phone" in q_lower or "mobile" in q_lower:
             category = "mobile"
-        if any(w in q_lower for w in ("tee", "tshirt", "t-shirts", "tees")):
+        if "tee" in q_lower or "tshirt" in q_lower or "t-shirt" in q_lower:
             category = "tshirt"
 
     filters = {"q": q, "category": category, "max_price": max_price, "color": color}
@@ -520,16 +765,36 @@ async def show_catalog(
     if not prods:
         return "Sorry, I couldn't find any items that match. You can try a simpler request, like 'show phones under 20,000' or 'black hoodies'."
 
-    lines = [f"Here are the top {min(8, len(prods))} items I found at Lalit's Shop:"]
-    for idx, p in enumerate(prods[:8], start=1):
-        size_info = f" (sizes: {', '.join(p['sizes'])})" if p.get("sizes") else ""
+    prods = prods[:8]
+    lines = [f"Here are the top {len(prods)} items I found at Lalit's Shop:"]
+    for idx, p in enumerate(prods, start=1):
+        size_info = f" (sizes: {', '.join(p.sizes)})" if p.sizes else ""
         lines.append(
-            f"{idx}. {p['name']} — ₹{p['price']} {p['currency']} (id: {p['id']}){size_info}"
+            f"{idx}. {p.name} — ₹{p.price} {p.currency} (id: {p.id}){size_info}"
         )
 
     lines.append("You can say: 'Add the second item, size M, quantity 1' or 'add mug-001 to my cart, quantity 2'.")
     return "\n".join(lines)
 
+# -------------------------
+# TOOLS
+# -------------------------
+
+@function_tool
+async def show_catalog(
+    ctx: RunContext[Userdata],
+    q: Annotated[Optional[str], Field(description="Search query (optional)", default=None)] = None,
+    category: Annotated[Optional[str], Field(description="Category (optional)", default=None)] = None,
+    max_price: Annotated[Optional[int], Field(description="Maximum price (optional)", default=None)] = None,
+    color: Annotated[Optional[str], Field(description="Color (optional)", default=None)] = None,
+) -> str:
+    """
+    Return a spoken summary of matching products (name, price, id).
+    - Recognizes category synonyms like 'phones', 'tees'.
+    - Returns up to 8 items.
+    """
+    return _catalog_reply(q, category, max_price, color)
+
 
 @function_tool
 async def add_to_cart(
@@ -544,8 +809,8 @@ async def add_to_cart(
     if not product:
         return "I couldn't figure out which product you meant. Try using the product id, like 'add tee-002, size M'."
 
-    if size and product.get("sizes") and size not in product["sizes"]:
-        return f"{product['name']} is not available in size {size}. Available sizes are: {', '.join(product['sizes'])}."
+    if size and product.sizes and size not in product.sizes:
+        return f"{product.name} is not available in size {size}. Available sizes are: {', '.join(product.sizes)}."
 
     attrs = {}
     if size:
@@ -553,27 +818,23 @@ async def add_to_cart(
 
     # merge with existing line item if same product+size
     for line in userdata.cart:
-        if line["product_id"] == product["id"] and line.get("attrs", {}).get("size") == attrs.get("size"):
+        if line["product_id"] == product.id and line.get("attrs", {}).get("size") == attrs.get("size"):
             line["quantity"] += quantity
             break
     else:
         userdata.cart.append(
             {
-                "product_id": product["id"],
+                "product_id": product.id,
+                "name": product.name,
+                "unit_price": product.price,
                 "quantity": quantity,
                 "attrs": attrs,
             }
         )
-
-    # compute total
-    total = 0
-    for li in userdata.cart:
-        prod = next((p for p in CATALOG if p["id"] == li["product_id"]), None)
-        if prod:
-            total += prod["price"] * li["quantity"]
+    userdata.cart_total += product.price * quantity
 
     size_str = f" in size {size}" if size else ""
-    return f"Added {quantity} x {product['name']}{size_str} to your cart. Current estimated total is around ₹{total}."
+    return f"Added {quantity} x {product.name}{size_str} to your cart. Current estimated total is around ₹{userdata.cart_total}."
 
 
 @function_tool
@@ -586,21 +847,16 @@ async def show_cart(
         return "Your cart is empty right now."
 
     lines: List[str] = []
-    total = 0
 
     for idx, li in enumerate(userdata.cart, start=1):
-        prod = next((p for p in CATALOG if p["id"] == li["product_id"]), None)
-        if not prod:
-            continue
-        line_total = prod["price"] * li["quantity"]
-        total += line_total
+        line_total = li["unit_price"] * li["quantity"]
         size = li.get("attrs", {}).get("size")
         size_text = f", size {size}" if size else ""
         lines.append(
-            f"{idx}. {prod['name']}{size_text} — {li['quantity']} x ₹{prod['price']} = ₹{line_total}"
+            f"{idx}. {li['name']}{size_text} — {li['quantity']} x ₹{li['unit_price']} = ₹{line_total}"
         )
 
-    lines.append(f"Total estimated amount: ₹{total}.")
+    lines.append(f"Total estimated amount: ₹{userdata.cart_total}.")
     lines.append("You can say: 'place my order' or 'remove the second item from my cart'.")
     return "\n".join(lines)
 
@@ -618,13 +874,25 @@ async def place_order(
     if customer_name:
         userdata.customer_name = customer_name.strip()
 
+    # detach the cart before awaiting the write: tool calls from one LLM turn
+    # run concurrently, and an add_to_cart landing meanwhile must go into the
+    # next cart rather than be wiped by the reset
+    cart, cart_total = userdata.cart, userdata.cart_total
+    userdata.cart, userdata.cart_total = [], 0
+
     try:
-        order = create_order_object(userdata.cart)
+        order = await create_order_object(cart)
     except ValueError as e:
+        # put the lines back ahead of anything added while we were waiting
+        userdata.cart = cart + userdata.cart
+        userdata.cart_total += cart_total
         return f"Something went wrong while creating the order: {e}"
+    except BaseException:
+        userdata.cart = cart + userdata.cart
+        userdata.cart_total += cart_total
+        raise
 
     userdata.orders.append(order)
-    userdata.cart = []
 
     name = userdata.customer_name or "customer"
     return (
@@ -640,7 +908,7 @@ async def show_last_order(
     ctx: RunContext[Userdata],
 ) -> str:
     """Summarize the most recent order from the global orders log."""
-    order = get_most_recent_order()
+    order = await get_most_recent_order()
     if not order:
         return "There are no orders recorded yet."
 
@@ -662,54 +930,62 @@ async def clear_cart(
 ) -> str:
     """Remove all items from the cart."""
     ctx.userdata.cart = []
+    ctx.userdata.cart_total = 0
     return "Your cart is now empty."
 
 # -------------------------
 # Agent Definition
 # -------------------------
 
+# Shared by every session; the Agent object itself carries per-session
+# activity state, so only its constant inputs are hoisted.
+_SHOP_INSTRUCTIONS = """
+You are a friendly shopping assistant for **Lalit's Shop**.
+
+CATALOG:
+- You can sell mugs, t-shirts, hoodies, raincoats, laptops, storage devices, and mobile phones.
+- Prices are in Indian Rupees (INR).
+- Use the tools to query the catalog; do NOT invent unknown products or prices.
+
+GOALS:
+- Help the user discover products based on their needs and budget.
+- Help them build a cart (add items, show cart).
+- Let them place an order and hear a summary of the last order.
+- Keep answers short and clear, like a good salesperson on a voice call.
+
+TOOLS:
+- `show_catalog(q, category, max_price, color)` to list items.
+- `add_to_cart(product_ref, quantity, size)` to put items in the cart.
+- `show_cart()` to summarize their current cart.
+- `place_order(customer_name?)` to turn the cart into an order.
+- `show_last_order()` to recall the latest order.
+- `clear_cart()` to empty the cart.
+
+BEHAVIOR:
+- After suggesting items, gently guide the user: e.g., ask if they want to add one to the cart.
+- When the user says something like "I want a phone under 20k", call `show_catalog` with suitable filters.
+- When they say "add the second phone in black, quantity 1", call `add_to_cart`.
+
+SAFETY:
+- Do not talk about internal implementation, tools or JSON.
+- Stay within the catalog; if something isn't available, say so honestly.
+"""
+
+_SHOP_TOOLS = (
+    show_catalog,
+    add_to_cart,
+    show_cart,
+    place_order,
+    show_last_order,
+    clear_cart,
+)
+
+
 class ShoppingAgent(Agent):
     def __init__(self):
         super().__init__(
-            instructions="""
-            You are a friendly shopping assistant for **Lalit's Shop**.
-
-            CATALOG:
-            - You can sell mugs, t-shirts, hoodies, raincoats, laptops, storage devices, and mobile phones.
-            - Prices are in Indian Rupees (INR).
-            - Use the tools to query the catalog; do NOT invent unknown products or prices.
-
-            GOALS:
-            - Help the user discover products based on their needs and budget.
-            - Help them build a cart (add items, show cart).
-            - Let them place an order and hear a summary of the last order.
-            - Keep answers short and clear, like a good salesperson on a voice call.
-
-            TOOLS:
-            - `show_catalog(q, category, max_price, color)` to list items.
-            - `add_to_cart(product_ref, quantity, size)` to put items in the cart.
-            - `show_cart()` to summarize their current cart.
-            - `place_order(customer_name?)` to turn the cart into an order.
-            - `show_last_order()` to recall the latest order.
-            - `clear_cart()` to empty the cart.
-
-            BEHAVIOR:
-            - After suggesting items, gently guide the user: e.g., ask if they want to add one to the cart.
-            - When the user says something like "I want a phone under 20k", call `show_catalog` with suitable filters.
-            - When they say "add the second phone in black, quantity 1", call `add_to_cart`.
-
-            SAFETY:
-            - Do not talk about internal implementation, tools or JSON.
-            - Stay within the catalog; if something isn't available, say so honestly.
-            """,
-            tools=[
-                show_catalog,
-                add_to_cart,
-                show_cart,
-                place_order,
-                show_last_order,
-                clear_cart,
-            ],
+            instructions=_SHOP_INSTRUCTIONS,
+            tools=list(_SHOP_TOOLS),
         )
 
 # -------------------------
@@ -717,8 +993,14 @@ class ShoppingAgent(Agent):
 # -------------------------
 
 def prewarm(proc: JobProcess):
-    """Preload VAD model for lower latency."""
-    proc.userdata["vad"] = silero.VAD.load()
+    """Preload VAD and the STT/LLM clients for lower latency."""
+    # shorter trailing silence than the 0.55s default so turns end sooner
+    proc.userdata["vad"] = silero.VAD.load(
+        min_silence_duration=0.2,
+        activation_threshold=0.5,
+    )
+    proc.userdata["stt"] = deepgram.STT(model="nova-3")
+    proc.userdata["llm"] = google.LLM(model="gemini-2.5-flash")
 
 
 async def entrypoint(ctx: JobContext):
@@ -728,28 +1010,41 @@ async def entrypoint(ctx: JobContext):
     userdata = Userdata()
 
     session = AgentSession(
-        stt=deepgram.STT(model="nova-3"),
-        llm=google.LLM(model="gemini-2.5-flash"),
+        stt=ctx.proc.userdata["stt"],
+        llm=ctx.proc.userdata["llm"],
+        # built here rather than in prewarm: its connection pool creates an
+        # asyncio.Lock, which Python 3.9 binds to the loop current at
+        # construction, and prewarm runs before the job loop exists
         tts=murf.TTS(
             voice="en-US-natalie",
             style="Conversational",
             text_pacing=True,
         ),
+        # the turn detector binds to the running job's inference executor,
+        # so it can't be built in prewarm
         turn_detection=MultilingualModel(),
         vad=ctx.proc.userdata["vad"],
+        min_endpointing_delay=0.3,
+        max_endpointing_delay=3.0,
         userdata=userdata,
     )
 
-    await session.start(
-        agent=ShoppingAgent(),
-        room=ctx.room,
-        room_input_options=RoomInputOptions(
-            noise_cancellation=noise_cancellation.BVC()
+    # the room connection and the session bootstrap are independent
+    # handshakes, so let them overlap (ctx.connect() is idempotent)
+    await asyncio.gather(
+        session.start(
+            agent=ShoppingAgent(),
+            room=ctx.room,
+            room_input_options=RoomInputOptions(
+                noise_cancellation=noise_cancellation.BVC(),
+                # keep the warm session (and the cart) alive across a user
+                # reconnect instead of closing when the participant drops
+                close_on_disconnect=False,
+            ),
         ),
+        ctx.connect(),
     )
 
-    await ctx.connect()
-
 
 if __name__ == "__main__":
     cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm))
@@ -0,0 +1,97 @@
+import pytest
+
+from agent import find_product_by_ref, list_products
+
+
+def _ids(products) -> list:
+    return [p.id for p in products]
+
+
+@pytest.mark.parametrize(
+    ("ref", "expected"),
+    [
+        # exact ids, case and surrounding whitespace ignored
+        ("mug-001", "mug-001"),
+        ("PHONE-003", "phone-003"),
+        ("  tee-002 ", "tee-002"),
+        # ordinals index the candidate list; they must be whole words
+        ("first", "mug-001"),
+        ("the third one", "hoodie-001"),
+        ("fourth", "mug-002"),
+        ("second phone", "phone-002"),
+        ("firstly", None),
+        # bare numbers are 1-based list positions
+        ("2", "tee-001"),
+        ("7", "tee-003"),
+        ("99", None),
+        ("phone 2", "phone-002"),
+        # colour + category
+        ("black hoodie", "hoodie-002"),
+        ("white mug", "mug-002"),
+        ("navy raincoat", "rain-002"),
+        # whole name words: all of them, then any of them
+        ("chai mug", "mug-001"),
+        ("oppo reno", "phone-005"),
+        ("samsung phone", "phone-003"),
+        ("hp pavilion", "laptop-004"),
+        ("cozy", "hoodie-001"),
+        ("zip-up", "hoodie-002"),
+        ("iphone", "phone-004"),
+        # partial words no longer match inside names
+        ("hood", None),
+        ("phone", None),
+        ("add a phone", None),
+        ("nothing here", None),
+        ("", None),
+    ],
+)
+def test_find_product_by_ref(ref, expected) -> None:
+    product = find_product_by_ref(ref)
+    assert (product.id if product else None) == expected
+
+
+@pytest.mark.parametrize(
+    ("ref", "expected"),
+    [
+        ("first", "phone-001"),
+        ("third", "phone-003"),
+        ("2", "phone-002"),
+        ("oppo", "phone-002"),
+        ("phone-002", "phone-002"),
+        # ids outside the candidate list are not resolved
+        ("mug-001", None),
+    ],
+)
+def test_find_product_by_ref_within_candidates(ref, expected) -> None:
+    candidates = list_products({"category": "mobile"})
+    product = find_product_by_ref(ref, candidates)
+    assert (product.id if product else None) == expected
+
+
+@pytest.mark.parametrize(
+    ("filters", "expected"),
+    [
+        ({"category": "phones"}, ["phone-001", "phone-002", "phone-003", "phone-004", "phone-005", "phone-006"]),
+        ({"category": "shirt"}, ["tee-001", "tee-002", "tee-003", "tee-004", "tee-005", "tee-006"]),
+        ({"category": "hoodie", "color": "Black"}, ["hoodie-002"]),
+        ({"color": "BLACK", "category": "laptop"}, ["laptop-002", "laptop-003"]),
+        ({"max_price": 299}, ["mug-001", "tee-002"]),
+        ({"to": 500}, ["mug-001", "tee-002", "tee-003", "tee-005"]),
+        ({"min_price": 20000, "max_price": 60000}, ["laptop-001", "laptop-002", "laptop-003", "phone-003", "phone-004", "phone-005", "phone-006"]),
+        ({"from": 60000}, ["laptop-003", "laptop-004"]),
+        ({"max_price": -1}, []),
+        # falsy or unparsable prices do not filter
+        ({"category": "laptop", "max_price": 0}, ["laptop-001", "laptop-002", "laptop-003", "laptop-004"]),
+        ({"category": "laptop", "max_price": "abc"}, ["laptop-001", "laptop-002", "laptop-003", "laptop-004"]),
+        ({"size": "XL", "max_price": 1000}, ["tee-001", "tee-002", "tee-003", "tee-004", "tee-006"]),
+        ({"size": "s"}, []),
+        # unhashable values bypass the filter cache instead of raising
+        ({"size": ["M"]}, []),
+        ({"category": "laptop", "max_price": [1]}, ["laptop-001", "laptop-002", "laptop-003", "laptop-004"]),
+        ({"q": "phone"}, ["phone-001", "phone-002", "phone-003", "phone-004", "phone-005", "phone-006"]),
+        ({"q": "Lightweight"}, ["hoodie-002", "tee-005"]),
+        ({"q": "mug", "color": "white"}, ["mug-002"]),
+    ],
+)
+def test_list_products(filters, expected) -> None:
+    assert _ids(list_products(filters)) == expected
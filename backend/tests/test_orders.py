@@ -0,0 +1,115 @@
+import asyncio
+import errno
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import agent
+
+
+@pytest.fixture
+def orders_log(tmp_path, monkeypatch):
+    """Point the orders log (and its legacy file) at a temp dir with a cold cache."""
+    path = tmp_path / "orders.jsonl"
+    monkeypatch.setattr(agent, "ORDERS_FILE", str(path))
+    monkeypatch.setattr(agent, "LEGACY_ORDERS_FILE", str(tmp_path / "orders.json"))
+    monkeypatch.setattr(agent, "_LAST_ORDER", None)
+    monkeypatch.setattr(agent, "_LAST_ORDER_STAMP", None)
+    return path
+
+
+def _order(order_id: str) -> dict:
+    return {"id": order_id, "items": [], "total": 0, "currency": "INR", "created_at": "2025-01-01T00:00:00Z"}
+
+
+def test_legacy_orders_migrate_once(orders_log, tmp_path) -> None:
+    legacy = tmp_path / "orders.json"
+    legacy.write_text(json.dumps([_order("order-1"), _order("order-2")]), encoding="utf-8")
+
+    agent._migrate_legacy_orders()
+    assert [o["id"] for o in agent._load_all_orders()] == ["order-1", "order-2"]
+
+    # an existing log is never overwritten by a later migration attempt
+    legacy.write_text(json.dumps([_order("order-3")]), encoding="utf-8")
+    agent._migrate_legacy_orders()
+    assert [o["id"] for o in agent._load_all_orders()] == ["order-1", "order-2"]
+
+
+def test_torn_trailing_line_is_skipped(orders_log) -> None:
+    orders_log.write_bytes(
+        json.dumps(_order("order-1")).encode() + b"\n"
+        + json.dumps(_order("order-2")).encode() + b"\n"
+        + b'{"id": "order-3", "ite'
+    )
+
+    assert [o["id"] for o in agent._load_all_orders()] == ["order-1", "order-2"]
+    assert agent._load_last_order()["id"] == "order-2"
+
+
+def test_append_after_torn_line_starts_a_new_line(orders_log) -> None:
+    orders_log.write_bytes(json.dumps(_order("order-1")).encode() + b'\n{"id": "order-2", "ite')
+
+    agent._append_order_line(_order("order-3"))
+
+    assert [o["id"] for o in agent._load_all_orders()] == ["order-1", "order-3"]
+    assert agent._load_last_order()["id"] == "order-3"
+
+
+async def test_most_recent_order_follows_the_log(orders_log) -> None:
+    assert await agent.get_most_recent_order() is None
+
+    order = await agent.create_order_object([{"product_id": "mug-001", "quantity": 2}])
+    assert await agent.get_most_recent_order() == order
+
+    # another job process appending to the same log is picked up
+    with open(orders_log, "ab") as f:
+        f.write(json.dumps(_order("order-other")).encode() + b"\n")
+    assert (await agent.get_most_recent_order())["id"] == "order-other"
+
+
+def _ctx() -> SimpleNamespace:
+    return SimpleNamespace(userdata=agent.Userdata())
+
+
+async def test_add_to_cart_during_place_order_lands_in_next_cart(orders_log) -> None:
+    ctx = _ctx()
+    await agent.add_to_cart(ctx, "mug-001", 1)
+
+    # tool calls from one LLM turn run concurrently
+    await asyncio.gather(agent.place_order(ctx), agent.add_to_cart(ctx, "tee-002", 2, "M"))
+
+    order = await agent.get_most_recent_order()
+    assert [li["product_id"] for li in order["items"]] == ["mug-001"]
+    assert [li["product_id"] for li in ctx.userdata.cart] == ["tee-002"]
+    assert ctx.userdata.cart_total == 598
+
+
+async def test_invalid_order_restores_cart(orders_log) -> None:
+    ctx = _ctx()
+    await agent.add_to_cart(ctx, "mug-001", 1)
+    ctx.userdata.cart.append({"product_id": "gone-001", "quantity": 1})
+
+    reply, _ = await asyncio.gather(agent.place_order(ctx), agent.add_to_cart(ctx, "tee-002", 1, "M"))
+
+    assert reply.startswith("Something went wrong")
+    # detached lines go back ahead of the one added meanwhile
+    assert [li["product_id"] for li in ctx.userdata.cart] == ["mug-001", "gone-001", "tee-002"]
+    assert ctx.userdata.cart_total == 598
+    assert not orders_log.exists()
+
+
+async def test_failed_write_restores_cart_and_raises(orders_log, monkeypatch) -> None:
+    def no_space(order):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(agent, "_append_order_line", no_space)
+    ctx = _ctx()
+    await agent.add_to_cart(ctx, "mug-001", 3)
+
+    with pytest.raises(OSError):
+        await agent.place_order(ctx)
+
+    assert [li["product_id"] for li in ctx.userdata.cart] == ["mug-001"]
+    assert ctx.userdata.cart_total == 897
+    assert await agent.get_most_recent_order() is None